@@ -1,27 +1,30 @@
 import os
+import re
+import queue
+import atexit
 import logging
+import threading
 import subprocess
 import tempfile
-import uuid
+from secrets import token_urlsafe
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from google.cloud import storage
+from google.api_core.exceptions import NotFound
+from google.cloud.storage.retry import DEFAULT_RETRY
 import vertexai
 from vertexai.generative_models import GenerativeModel, Part
 from dotenv import load_dotenv
 
-# Optimization: increasing chunk size to 5MB for better stability
-storage.blob._DEFAULT_CHUNKSIZE = 5 * 1024 * 1024
-
 # Load env variables locally
 load_dotenv()
 
 # Configuration
 # Configuration
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -29,23 +32,38 @@ logger.setLevel(logging.INFO)
 
 # Create handlers
 c_handler = logging.StreamHandler()
-f_handler = RotatingFileHandler('app.log', maxBytes=10*1024*1024, backupCount=5, encoding='utf-8')
+log_handlers = [c_handler]
 
 # Create formatters and add it to handlers
 c_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-f_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 c_handler.setFormatter(c_format)
-f_handler.setFormatter(f_format)
+
+# Cloud Run (K_SERVICE is set) collects stdout itself; only keep a local log file elsewhere.
+# The file stream stays line-flushed: writes already happen on the listener thread,
+# and a large write buffer would drop the last records if the process crashes.
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 50 * 1024 * 1024))
+if not os.getenv("K_SERVICE"):
+    f_handler = RotatingFileHandler('app.log', maxBytes=LOG_MAX_BYTES, backupCount=5, encoding='utf-8')
+    f_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    f_handler.setFormatter(f_format)
+    log_handlers.append(f_handler)
+
+# Handlers run on a background listener thread; request threads only enqueue records
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
 
 # Add handlers to the logger
 if not logger.handlers:
-    logger.addHandler(c_handler)
-    logger.addHandler(f_handler)
+    logger.addHandler(QueueHandler(log_queue))
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 PROJECT_ID = os.getenv("PROJECT_ID")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 # Trigger reload for key.json
 LOCATION = os.getenv("LOCATION", "us-central1")
+# Use system temp to avoid Hebrew path issues on Windows
+TEMP_DIR = os.environ.get("TEMP", "/tmp")
 
 # Initialize Vertex AI
 try:
@@ -60,6 +78,30 @@ except Exception as e:
     logger.error(f"Failed to initialize Vertex AI: {e}")
     model = None
 
+# Shared GCS client (credentials + HTTP connection pool), created on first use
+_storage_client = None
+_storage_client_lock = threading.Lock()
+_bucket = None
+
+
+def get_storage_client() -> storage.Client:
+    """Return the process-wide GCS client."""
+    global _storage_client
+    if _storage_client is None:
+        with _storage_client_lock:
+            if _storage_client is None:
+                _storage_client = storage.Client()
+    return _storage_client
+
+
+def get_bucket() -> storage.Bucket:
+    """Return the shared handle for BUCKET_NAME."""
+    global _bucket
+    if _bucket is None:
+        _bucket = get_storage_client().bucket(BUCKET_NAME)
+    return _bucket
+
+
 app = FastAPI()
 
 # Enable CORS for Chrome Extension & Localhost
@@ -75,6 +117,52 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="static", html=True), name="static")
 
 
+# Only plain http(s) links are handed to yt-dlp (anything else could be parsed as a CLI flag)
+_URL_RE = re.compile(r"https?://\S+", re.IGNORECASE)
+_UNSAFE_NAME_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+ANALYSIS_PROMPT = """
+Analyze this audio file (Hebrew).
+1. Summarize the key points.
+2. Create a 10-question multiple choice quiz.
+Return RAW JSON.
+"""
+
+# yt-dlp --audio-format rules: mp3/opus/flac streams are kept as-is, AAC is
+# remuxed into m4a, and anything else is transcoded to AAC/m4a
+YTDLP_AUDIO_FORMAT = "mp3>mp3/opus>opus/flac>flac/m4a"
+AUDIO_MIME_TYPES = {
+    "m4a": "audio/mp4",
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",
+    "flac": "audio/flac",
+}
+
+
+# Resumable upload chunks must be a multiple of 256 KiB
+CHUNK_ALIGN = 256 * 1024
+MIN_UPLOAD_CHUNK = 8 * 1024 * 1024
+MAX_UPLOAD_CHUNK = 16 * 1024 * 1024
+
+
+def upload_chunk_size(size: int = 0) -> int:
+    """Pick a resumable-upload chunk size for an object of the given size (0 if unknown)."""
+    aligned = -(-size // CHUNK_ALIGN) * CHUNK_ALIGN
+    return min(max(MIN_UPLOAD_CHUNK, aligned), MAX_UPLOAD_CHUNK)
+
+
+def upload_new_blob(blob, file_obj, size=None, content_type=None):
+    """Upload to a not-yet-existing blob; the generation-0 precondition makes retries safe."""
+    blob.upload_from_file(
+        file_obj,
+        size=size,
+        content_type=content_type,
+        timeout=600,
+        if_generation_match=0,
+        retry=DEFAULT_RETRY,
+    )
+
+
 class UrlRequest(BaseModel):
     url: str
 
@@ -84,34 +172,34 @@ async def read_root():
     return FileResponse("static/index.html")
 
 
-def upload_to_gcs_and_analyze(audio_path: str, filename: str) -> dict:
+def safe_blob_name(filename: str) -> str:
+    """Build a GCS object name from an untrusted upload filename."""
+    name = _UNSAFE_NAME_RE.sub("_", os.path.basename(filename or ""))[:128] or "upload"
+    return f"{token_urlsafe(6)}_{name}"
+
+
+def upload_to_gcs_and_analyze(audio_path: str, filename: str, mime_type: str = "audio/mpeg") -> dict:
     """Upload audio file to GCS and analyze with Gemini."""
     if not BUCKET_NAME:
         raise HTTPException(status_code=500, detail="BUCKET_NAME not set")
     if not model:
         raise HTTPException(status_code=500, detail="Vertex AI not initialized")
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob(filename)
+    bucket = get_bucket()
+    size = os.path.getsize(audio_path)
+    blob = bucket.blob(filename, chunk_size=upload_chunk_size(size))
     
     logger.info(f"Uploading {filename} to GCS")
-    blob.upload_from_filename(audio_path, timeout=600)
+    with open(audio_path, "rb") as audio_file:
+        upload_new_blob(blob, audio_file, size=size, content_type=mime_type)
     gs_uri = f"gs://{BUCKET_NAME}/{filename}"
     logger.info(f"Upload complete: {gs_uri}")
     
     try:
         logger.info("Sending to Gemini...")
-        audio_part = Part.from_uri(uri=gs_uri, mime_type="audio/mpeg")
-        
-        prompt = """
-        Analyze this audio file (Hebrew).
-        1. Summarize the key points.
-        2. Create a 10-question multiple choice quiz.
-        Return RAW JSON.
-        """
+        audio_part = Part.from_uri(uri=gs_uri, mime_type=mime_type)
         
-        response = model.generate_content([audio_part, prompt])
+        response = model.generate_content([audio_part, ANALYSIS_PROMPT])
         logger.info("Gemini response received")
         
         # Cleanup GCS
@@ -126,8 +214,10 @@ def upload_to_gcs_and_analyze(audio_path: str, filename: str) -> dict:
     except Exception as e:
         try:
             blob.delete()
-        except:
+        except NotFound:
             pass
+        except Exception as cleanup_error:
+            logger.warning(f"Failed to delete blob: {cleanup_error}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -137,13 +227,13 @@ def analyze_audio(file: UploadFile = File(...)):
     if not BUCKET_NAME or not model:
         raise HTTPException(status_code=500, detail="Service not configured")
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob(file.filename)
+    blob_name = safe_blob_name(file.filename)
+    bucket = get_bucket()
+    blob = bucket.blob(blob_name, chunk_size=upload_chunk_size())
     
-    logger.info(f"Starting upload for {file.filename}")
-    blob.upload_from_file(file.file, timeout=600)
-    gs_uri = f"gs://{BUCKET_NAME}/{file.filename}"
+    logger.info(f"Starting upload for {file.filename} as {blob_name}")
+    upload_new_blob(blob, file.file)
+    gs_uri = f"gs://{BUCKET_NAME}/{blob_name}"
     logger.info(f"Upload complete: {gs_uri}")
     
     try:
@@ -151,19 +241,12 @@ def analyze_audio(file: UploadFile = File(...)):
         mime_type = file.content_type or "audio/mpeg"
         audio_part = Part.from_uri(uri=gs_uri, mime_type=mime_type)
         
-        prompt = """
-        Analyze this audio file (Hebrew).
-        1. Summarize the key points.
-        2. Create a 10-question multiple choice quiz.
-        Return RAW JSON.
-        """
-        
-        response = model.generate_content([audio_part, prompt])
+        response = model.generate_content([audio_part, ANALYSIS_PROMPT])
         logger.info("Gemini response received")
         
         try:
             blob.delete()
-            logger.info(f"Deleted {file.filename} from GCS")
+            logger.info(f"Deleted {blob_name} from GCS")
         except Exception as e:
             logger.warning(f"Failed to delete blob: {e}")
         
@@ -172,37 +255,40 @@ def analyze_audio(file: UploadFile = File(...)):
     except Exception as e:
         try:
             blob.delete()
-        except:
+        except NotFound:
             pass
+        except Exception as cleanup_error:
+            logger.warning(f"Failed to delete blob: {cleanup_error}")
         logger.error(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/analyze-url")
-async def analyze_url(request: UrlRequest):
+def analyze_url(request: UrlRequest):
     """Download video from URL, extract audio, and analyze with Gemini."""
     url = request.url
     
     if not url:
         raise HTTPException(status_code=400, detail="URL is required")
+    if not _URL_RE.fullmatch(url):
+        raise HTTPException(status_code=400, detail="Invalid URL")
     
-    task_id = str(uuid.uuid4())[:8]  # Short ID for safe filenames
+    task_id = token_urlsafe(6)  # Short ID for safe filenames
     
-    # Use system temp to avoid Hebrew path issues on Windows
-    safe_temp = os.environ.get("TEMP", "/tmp")
-    audio_filename = f"audio_{task_id}.mp3"
-    audio_path = os.path.join(safe_temp, audio_filename)
+    audio_prefix = f"audio_{task_id}."
+    audio_path = None
     
     try:
         # Step 1: Download and extract audio directly with yt-dlp
-        # Using -x (extract audio) + --audio-format mp3 to skip ffmpeg step
+        # Codecs Gemini accepts are only copied out of the container (no re-encode)
         logger.info(f"Downloading audio from: {url}")
         download_cmd = [
             "yt-dlp",
+            "-f", "bestaudio/best",
             "-x",  # Extract audio
-            "--audio-format", "mp3",
+            "--audio-format", YTDLP_AUDIO_FORMAT,
             "--audio-quality", "4",
-            "-o", audio_path.replace(".mp3", ".%(ext)s"),  # yt-dlp will add extension
+            "-o", os.path.join(TEMP_DIR, f"{audio_prefix}%(ext)s"),  # yt-dlp will add extension
             "--no-playlist",
             "--no-warnings",
             "--quiet",
@@ -216,19 +302,21 @@ async def analyze_url(request: UrlRequest):
             logger.error(f"yt-dlp error: {error_msg}")
             raise HTTPException(status_code=400, detail=f"הורדה נכשלה: {error_msg[:200]}")
         
-        # Find the downloaded mp3 file
-        if not os.path.exists(audio_path):
-            # yt-dlp might have created it with different name
-            possible_files = [f for f in os.listdir(safe_temp) if f.startswith(f"audio_{task_id}") and f.endswith(".mp3")]
-            if possible_files:
-                audio_path = os.path.join(safe_temp, possible_files[0])
-            else:
-                raise HTTPException(status_code=500, detail="הורדה נכשלה - קובץ לא נמצא")
+        # Find the extracted file; its extension tells which codec was kept
+        possible_files = [
+            f for f in os.listdir(TEMP_DIR)
+            if f.startswith(audio_prefix) and f.rpartition(".")[2] in AUDIO_MIME_TYPES
+        ]
+        if not possible_files:
+            raise HTTPException(status_code=500, detail="הורדה נכשלה - קובץ לא נמצא")
+        audio_filename = possible_files[0]
+        audio_path = os.path.join(TEMP_DIR, audio_filename)
         
         logger.info(f"Audio downloaded: {audio_path}")
         
         # Step 2: Upload to GCS and analyze
-        result = upload_to_gcs_and_analyze(audio_path, audio_filename)
+        mime_type = AUDIO_MIME_TYPES[audio_filename.rpartition(".")[2]]
+        result = upload_to_gcs_and_analyze(audio_path, audio_filename, mime_type=mime_type)
         
         # Cleanup local file
         try:
@@ -246,7 +334,7 @@ async def analyze_url(request: UrlRequest):
         logger.error(f"Error processing URL: {e}")
         # Cleanup on error
         try:
-            if os.path.exists(audio_path):
+            if audio_path and os.path.exists(audio_path):
                 os.remove(audio_path)
         except:
             pass
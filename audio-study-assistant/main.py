@@ -4,13 +4,18 @@ Production-ready serverless application for Google Cloud Run
 """
 
 import os
+import re
+import orjson
 import uuid
+import threading
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
 
 import vertexai
 from vertexai.generative_models import GenerativeModel, Part
@@ -20,11 +25,57 @@ PROJECT_ID = "YOUR_PROJECT_ID"
 BUCKET_NAME = "YOUR_BUCKET_NAME"
 LOCATION = "us-central1"
 
+ALLOWED_EXTENSIONS = frozenset({'mp3', 'wav', 'flac', 'm4a', 'ogg', 'webm', 'aac', 'wma', 'mp4'})
+ALLOWED_EXTENSIONS_TEXT = ', '.join(sorted(ALLOWED_EXTENSIONS))
+
+MIME_TYPES = {
+    'mp3': 'audio/mpeg',
+    'wav': 'audio/wav',
+    'flac': 'audio/flac',
+    'm4a': 'audio/mp4',
+    'ogg': 'audio/ogg',
+    'webm': 'audio/webm',
+    'aac': 'audio/aac',
+    'wma': 'audio/x-ms-wma',
+    'mp4': 'audio/mp4',
+}
+
+# Lecture summary + quiz prompt sent with every audio file
+ANALYSIS_PROMPT = """Summarize this lecture in Hebrew and create a 10-question multiple choice quiz in JSON format.
+
+Your response should be in the following structure:
+1. First, provide a comprehensive summary in Hebrew
+2. Then, provide the quiz in valid JSON format with the following structure:
+
+```json
+{
+  "quiz": [
+    {
+      "question": "השאלה בעברית",
+      "options": ["א. תשובה 1", "ב. תשובה 2", "ג. תשובה 3", "ד. תשובה 4"],
+      "correct_answer": "א. תשובה 1",
+      "explanation": "הסבר קצר"
+    }
+  ]
+}
+```
+
+Make sure the quiz tests understanding of key concepts from the lecture."""
+
+# Fenced ```json block in Gemini responses
+JSON_BLOCK_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+
+# Resumable upload chunk size (must be a multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+HEALTH_STATUS = {"status": "healthy", "service": "audio-study-assistant"}
+
 # Initialize FastAPI
 app = FastAPI(
     title="Audio Study Assistant",
     description="Upload audio lectures and get AI-powered summaries and quizzes",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS for Chrome extension
@@ -41,6 +92,30 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Initialize Vertex AI
 vertexai.init(project=PROJECT_ID, location=LOCATION)
+model = GenerativeModel("gemini-1.5-pro")
+
+# Shared GCS client (credentials + HTTP connection pool), created on first use
+_storage_client = None
+_storage_client_lock = threading.Lock()
+_bucket = None
+
+
+def get_storage_client() -> storage.Client:
+    """Return the process-wide GCS client."""
+    global _storage_client
+    if _storage_client is None:
+        with _storage_client_lock:
+            if _storage_client is None:
+                _storage_client = storage.Client(project=PROJECT_ID)
+    return _storage_client
+
+
+def get_bucket() -> storage.Bucket:
+    """Return the shared handle for BUCKET_NAME."""
+    global _bucket
+    if _bucket is None:
+        _bucket = get_storage_client().bucket(BUCKET_NAME)
+    return _bucket
 
 
 class AnalyzeRequest(BaseModel):
@@ -64,19 +139,8 @@ class UploadResponse(BaseModel):
 
 def get_mime_type(filename: str) -> str:
     """Determine MIME type based on file extension"""
-    extension = filename.lower().split('.')[-1]
-    mime_types = {
-        'mp3': 'audio/mpeg',
-        'wav': 'audio/wav',
-        'flac': 'audio/flac',
-        'm4a': 'audio/mp4',
-        'ogg': 'audio/ogg',
-        'webm': 'audio/webm',
-        'aac': 'audio/aac',
-        'wma': 'audio/x-ms-wma',
-        'mp4': 'audio/mp4',
-    }
-    return mime_types.get(extension, 'audio/mpeg')
+    extension = filename.rpartition('.')[2].lower()
+    return MIME_TYPES.get(extension, 'audio/mpeg')
 
 
 @app.get("/")
@@ -88,7 +152,7 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint for Cloud Run"""
-    return {"status": "healthy", "service": "audio-study-assistant"}
+    return HEALTH_STATUS
 
 
 @app.post("/upload", response_model=UploadResponse)
@@ -104,30 +168,29 @@ async def upload_audio(file: UploadFile = File(...)):
     """
     try:
         # Validate file type
-        allowed_extensions = {'mp3', 'wav', 'flac', 'm4a', 'ogg', 'webm', 'aac', 'wma', 'mp4'}
-        file_extension = file.filename.lower().split('.')[-1] if file.filename else ''
+        _, dot, file_extension = (file.filename or '').rpartition('.')
+        file_extension = file_extension.lower() if dot else ''
         
-        if file_extension not in allowed_extensions:
+        if file_extension not in ALLOWED_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
-                detail=f"Unsupported file type: {file_extension}. Allowed: {', '.join(allowed_extensions)}"
+                detail=f"Unsupported file type: {file_extension}. Allowed: {ALLOWED_EXTENSIONS_TEXT}"
             )
         
         # Generate unique filename
         unique_filename = f"{uuid.uuid4()}_{file.filename}"
         
-        # Initialize GCS client and upload
-        storage_client = storage.Client(project=PROJECT_ID)
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(f"audio-uploads/{unique_filename}")
-        
-        # Read file content
-        file_content = await file.read()
+        # Destination blob
+        blob = get_bucket().blob(f"audio-uploads/{unique_filename}", chunk_size=UPLOAD_CHUNK_SIZE)
         
-        # Upload to GCS
-        blob.upload_from_string(
-            file_content,
-            content_type=get_mime_type(file.filename)
+        # Stream the spooled upload to GCS in resumable chunks; generation 0
+        # means create-only, so retries can never overwrite an existing object
+        await run_in_threadpool(
+            blob.upload_from_file,
+            file.file,
+            content_type=get_mime_type(file.filename),
+            if_generation_match=0,
+            retry=DEFAULT_RETRY,
         )
         
         gs_uri = f"gs://{BUCKET_NAME}/audio-uploads/{unique_filename}"
@@ -170,51 +233,23 @@ async def analyze_audio(request: AnalyzeRequest):
         filename = request.gs_uri.split('/')[-1]
         mime_type = get_mime_type(filename)
         
-        # Initialize the model
-        model = GenerativeModel("gemini-1.5-pro")
-        
         # Create audio part from GCS URI
         audio_part = Part.from_uri(request.gs_uri, mime_type=mime_type)
         
-        # Define the prompt
-        prompt = """Summarize this lecture in Hebrew and create a 10-question multiple choice quiz in JSON format.
-
-Your response should be in the following structure:
-1. First, provide a comprehensive summary in Hebrew
-2. Then, provide the quiz in valid JSON format with the following structure:
-
-```json
-{
-  "quiz": [
-    {
-      "question": "השאלה בעברית",
-      "options": ["א. תשובה 1", "ב. תשובה 2", "ג. תשובה 3", "ד. תשובה 4"],
-      "correct_answer": "א. תשובה 1",
-      "explanation": "הסבר קצר"
-    }
-  ]
-}
-```
-
-Make sure the quiz tests understanding of key concepts from the lecture."""
-
         # Generate content
-        response = model.generate_content([audio_part, prompt])
+        response = await run_in_threadpool(model.generate_content, [audio_part, ANALYSIS_PROMPT])
         
         raw_text = response.text
         
         # Try to extract quiz JSON from response
         quiz = None
         try:
-            import json
-            import re
-            
             # Look for JSON block in response
-            json_match = re.search(r'```json\s*(.*?)\s*```', raw_text, re.DOTALL)
+            json_match = JSON_BLOCK_RE.search(raw_text)
             if json_match:
-                quiz_data = json.loads(json_match.group(1))
+                quiz_data = orjson.loads(json_match.group(1))
                 quiz = quiz_data.get('quiz', [])
-        except (json.JSONDecodeError, AttributeError):
+        except (orjson.JSONDecodeError, AttributeError):
             # If JSON parsing fails, quiz will remain None
             pass
         
@@ -15,58 +15,48 @@ IAM Permissions Required:
 import boto3
 import os
 import json
+import time
+from botocore.exceptions import ClientError
+from string import Template
 
-# Initialize EC2 client
+# Initialize EC2 client once per container so warm invocations reuse its connection pool
 ec2 = boto3.client('ec2')
 
 # Get environment variables
 INSTANCE_ID = os.environ.get('EC2_INSTANCE_ID')
 MAIN_SITE_URL = os.environ.get('MAIN_SITE_URL', 'http://your-site-url.com')
 
+# Last observed [state, timestamp]; warm containers reuse it for repeat hits
+STATE_CACHE_TTL = 10
+_last_state = [None, 0.0]
 
-def get_instance_state():
-    """Get the current state of the EC2 instance."""
-    try:
-        response = ec2.describe_instances(InstanceIds=[INSTANCE_ID])
-        state = response['Reservations'][0]['Instances'][0]['State']['Name']
-        return state
-    except Exception as e:
-        return f"error: {str(e)}"
+STATUS_ICONS = {
+    "status-waking": "⏳",
+    "status-running": "✅",
+    "status-error": "❌",
+}
 
-
-def start_instance():
-    """Start the EC2 instance."""
-    try:
-        ec2.start_instances(InstanceIds=[INSTANCE_ID])
-        return True
-    except Exception as e:
-        return str(e)
-
-
-def generate_html_response(title, message, status_class, show_refresh=False):
-    """Generate a styled HTML response page."""
-    
-    refresh_button = ""
-    if show_refresh:
-        refresh_button = f'''
+LOADER_HTML = "<div class='loader'></div>"
+REFRESH_BUTTON_HTML = f'''
             <a href="{MAIN_SITE_URL}" class="btn">🚀 Go to Main Site</a>
             <p class="hint">Please wait ~2 minutes for the server to fully boot up.</p>
         '''
-    
-    html = f'''<!DOCTYPE html>
+
+# Static page shell; only the $placeholders change between invocations
+HTML_TEMPLATE = Template('''<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{title}</title>
+    <title>$title</title>
     <style>
-        * {{
+        * {
             margin: 0;
             padding: 0;
             box-sizing: border-box;
-        }}
+        }
         
-        body {{
+        body {
             font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
             background: linear-gradient(135deg, #1a1a2e 0%, #16213e 50%, #0f3460 100%);
             min-height: 100vh;
@@ -74,9 +64,9 @@ def generate_html_response(title, message, status_class, show_refresh=False):
             align-items: center;
             justify-content: center;
             color: #fff;
-        }}
+        }
         
-        .container {{
+        .container {
             text-align: center;
             padding: 3rem;
             background: rgba(255, 255, 255, 0.05);
@@ -85,34 +75,34 @@ def generate_html_response(title, message, status_class, show_refresh=False):
             border: 1px solid rgba(255, 255, 255, 0.1);
             max-width: 500px;
             box-shadow: 0 25px 50px -12px rgba(0, 0, 0, 0.5);
-        }}
+        }
         
-        .icon {{
+        .icon {
             font-size: 4rem;
             margin-bottom: 1.5rem;
-        }}
+        }
         
-        .status-waking {{ color: #fbbf24; }}
-        .status-running {{ color: #34d399; }}
-        .status-error {{ color: #f87171; }}
-        .status-stopped {{ color: #94a3b8; }}
+        .status-waking { color: #fbbf24; }
+        .status-running { color: #34d399; }
+        .status-error { color: #f87171; }
+        .status-stopped { color: #94a3b8; }
         
-        h1 {{
+        h1 {
             font-size: 1.8rem;
             margin-bottom: 1rem;
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             -webkit-background-clip: text;
             -webkit-text-fill-color: transparent;
             background-clip: text;
-        }}
+        }
         
-        .message {{
+        .message {
             color: #a5b4fc;
             line-height: 1.6;
             margin-bottom: 2rem;
-        }}
+        }
         
-        .btn {{
+        .btn {
             display: inline-block;
             padding: 1rem 2rem;
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
@@ -122,20 +112,20 @@ def generate_html_response(title, message, status_class, show_refresh=False):
             font-weight: 600;
             transition: all 0.3s ease;
             box-shadow: 0 4px 15px rgba(102, 126, 234, 0.4);
-        }}
+        }
         
-        .btn:hover {{
+        .btn:hover {
             transform: translateY(-2px);
             box-shadow: 0 8px 25px rgba(102, 126, 234, 0.6);
-        }}
+        }
         
-        .hint {{
+        .hint {
             margin-top: 1.5rem;
             font-size: 0.9rem;
             color: #6b7280;
-        }}
+        }
         
-        .loader {{
+        .loader {
             width: 50px;
             height: 50px;
             border: 3px solid rgba(255, 255, 255, 0.1);
@@ -143,26 +133,91 @@ def generate_html_response(title, message, status_class, show_refresh=False):
             border-radius: 50%;
             animation: spin 1s linear infinite;
             margin: 1.5rem auto;
-        }}
+        }
         
-        @keyframes spin {{
-            0% {{ transform: rotate(0deg); }}
-            100% {{ transform: rotate(360deg); }}
-        }}
+        @keyframes spin {
+            0% { transform: rotate(0deg); }
+            100% { transform: rotate(360deg); }
+        }
     </style>
 </head>
 <body>
     <div class="container">
-        <div class="icon {status_class}">
-            {"⏳" if status_class == "status-waking" else "✅" if status_class == "status-running" else "❌" if status_class == "status-error" else "💤"}
+        <div class="icon $status_class">
+            $icon
         </div>
-        <h1>{title}</h1>
-        <p class="message">{message}</p>
-        {"<div class='loader'></div>" if status_class == "status-waking" else ""}
-        {refresh_button}
+        <h1>$title</h1>
+        <p class="message">$message</p>
+        $loader
+        $refresh_button
     </div>
 </body>
-</html>'''
+</html>''')
+
+
+def get_instance_state():
+    """Get the current state of the EC2 instance."""
+    try:
+        response = ec2.describe_instances(InstanceIds=[INSTANCE_ID])
+        state = response['Reservations'][0]['Instances'][0]['State']['Name']
+        return state
+    except Exception as e:
+        return f"error: {str(e)}"
+
+
+def _start_instance():
+    """Call StartInstances and return (previous_state, current_state)."""
+    response = ec2.start_instances(InstanceIds=[INSTANCE_ID])
+    instance = response['StartingInstances'][0]
+    return instance['PreviousState']['Name'], instance['CurrentState']['Name']
+
+
+def wake_instance():
+    """
+    Start the EC2 instance and return the state to report to the user.
+
+    StartInstances is a no-op for pending/running instances and reports the
+    previous state, so the common paths cost a single EC2 call. States it
+    rejects (e.g. stopping) fall back to DescribeInstances. A recent cached
+    current state is returned as-is without calling EC2.
+    """
+    cached_state, checked_at = _last_state
+    if cached_state and time.time() - checked_at < STATE_CACHE_TTL:
+        return cached_state
+
+    try:
+        state, current_state = _start_instance()
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'IncorrectInstanceState':
+            return f"error: {str(e)}"
+        state = current_state = get_instance_state()
+        # It finished stopping in the meantime - start it for real
+        if state == 'stopped':
+            try:
+                state, current_state = _start_instance()
+            except Exception as e:
+                return f"error: {str(e)}"
+    except Exception as e:
+        return f"error: {str(e)}"
+
+    # Only cache states that need no further start call; caching 'stopped' or
+    # 'stopping' would let a retry skip StartInstances once the instance stops
+    if current_state in ('pending', 'running'):
+        _last_state[:] = [current_state, time.time()]
+    return state
+
+
+def generate_html_response(title, message, status_class, show_refresh=False):
+    """Generate a styled HTML response page."""
+    
+    html = HTML_TEMPLATE.substitute(
+        title=title,
+        message=message,
+        status_class=status_class,
+        icon=STATUS_ICONS.get(status_class, "💤"),
+        loader=LOADER_HTML if status_class == "status-waking" else "",
+        refresh_button=REFRESH_BUTTON_HTML if show_refresh else "",
+    )
     
     return html
 
@@ -188,13 +243,13 @@ def lambda_handler(event, context):
             'body': html
         }
     
-    # Get current instance state
-    state = get_instance_state()
+    # Start the instance if needed; returns the state it was in before
+    state = wake_instance()
     
     if state.startswith("error"):
         html = generate_html_response(
             "Error",
-            f"Failed to check instance status: {state}",
+            f"Failed to start or check the server: {state}",
             "status-error"
         )
         return {
@@ -205,37 +260,10 @@ def lambda_handler(event, context):
     
     # Handle different instance states
     if state == 'stopped':
-        # Start the instance
-        result = start_instance()
-        if result == True:
-            html = generate_html_response(
-                "🌅 Server is Waking Up!",
-                "The transcription server was sleeping and is now starting up. This typically takes about 2 minutes.",
-                "status-waking",
-                show_refresh=True
-            )
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'text/html'},
-                'body': html
-            }
-        else:
-            html = generate_html_response(
-                "Failed to Start",
-                f"Could not start the server: {result}",
-                "status-error"
-            )
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'text/html'},
-                'body': html
-            }
-    
-    elif state == 'running':
         html = generate_html_response(
-            "✨ Server is Already Running!",
-            "Great news! The transcription server is already up and running.",
-            "status-running",
+            "🌅 Server is Waking Up!",
+            "The transcription server was sleeping and is now starting up. This typically takes about 2 minutes.",
+            "status-waking",
             show_refresh=True
         )
         return {
@@ -244,16 +272,24 @@ def lambda_handler(event, context):
             'body': html
         }
     
+    elif state == 'running':
+        # Nothing to wait for - send the user straight to the app
+        return {
+            'statusCode': 302,
+            'headers': {'Location': MAIN_SITE_URL, 'Cache-Control': 'no-store'},
+            'body': ''
+        }
+    
     elif state == 'pending':
         html = generate_html_response(
             "⏳ Server is Starting...",
-            "The server is currently starting up. Please wait a moment and refresh this page.",
+            "The server is currently starting up. This page refreshes automatically.",
             "status-waking",
             show_refresh=True
         )
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'text/html'},
+            'headers': {'Content-Type': 'text/html', 'Refresh': '5', 'Cache-Control': 'no-store'},
             'body': html
         }
     